@@ -1,7 +1,7 @@
 import bpy
 import bmesh
 import numpy as np
-from mathutils import Matrix
+from mathutils import Euler, Matrix, Vector
 
 bl_info = {
     "name": "Collision Creator",
@@ -13,6 +13,13 @@ bl_info = {
     "category": "Object",
 }
 
+# Faces of a box whose corners are ordered as (x, y, z) in (min, max) combinations
+BOX_FACES = (
+    (0, 1, 3, 2), (4, 6, 7, 5),  # -X, +X
+    (0, 4, 5, 1), (2, 3, 7, 6),  # -Y, +Y
+    (0, 2, 6, 4), (1, 5, 7, 3),  # -Z, +Z
+)
+
 # Group for panel properties
 class CollisionBlockProperties(bpy.types.PropertyGroup): 
     method: bpy.props.EnumProperty(
@@ -67,31 +74,55 @@ class CollisionBlockProperties(bpy.types.PropertyGroup):
         subtype="EULER"
     )
 
-def get_selected_vertices(obj):
-    """Get selected vertices in Edit Mode or all vertices in Object Mode."""
-    if bpy.context.mode == 'EDIT_MESH':
-        bm = bmesh.from_edit_mesh(obj.data)
-        bm.verts.ensure_lookup_table()
-        return [obj.matrix_world @ v.co for v in bm.verts if v.select]  # Global coordinates
-    elif bpy.context.mode == 'OBJECT':
-        return [obj.matrix_world @ v.co for v in obj.data.vertices]  # Global coordinates
-    return []
+def get_selected_vertices(obj, mode):
+    """Get selected vertices in Edit Mode or all vertices in Object Mode as an (N, 3) array of global coordinates."""
+    if mode == 'EDIT_MESH':
+        # Flush the edit-mesh into obj.data so it can be read in bulk
+        obj.update_from_editmode()
+    elif mode != 'OBJECT':
+        return np.empty((0, 3), dtype=np.float32)
+
+    vertices = obj.data.vertices
+    n = len(vertices)
+    flat = np.empty(n * 3, dtype=np.float32)
+    vertices.foreach_get("co", flat)
+    coords = flat.reshape(n, 3)
+
+    if mode == 'EDIT_MESH':
+        selected = np.empty(n, dtype=bool)
+        vertices.foreach_get("select", selected)
+        coords = coords[selected]
+
+    # Global coordinates: one product with the world matrix for all vertices
+    M = np.array(obj.matrix_world, dtype=np.float64)
+    R = M[:3, :3]
+    t = M[:3, 3]
+    return coords @ R.T + t
 
 def generate_block_name(obj_name, use_selected_mesh_name, prefix, custom_name, block_number):
     """Generate block name based on the chosen mode."""
     if use_selected_mesh_name == 'true':
-        return f"{prefix}{obj_name}_{str(block_number).zfill(2)}"
+        return f"{prefix}{obj_name}_{block_number:02d}"
     else:
         return custom_name
 
+def get_next_block_number(prefix):
+    """Return the number following the highest trailing block number among objects starting with the prefix."""
+    max_number = 0
+    for name in bpy.data.objects.keys():
+        if name.startswith(prefix):
+            suffix = name.rpartition("_")[2]
+            if suffix.isdecimal():
+                max_number = max(max_number, int(suffix))
+    return max_number + 1
+
 def refresh_object_names(prefix, active_object_name):
     """Refresh names of objects that start with the given prefix and include the active object name."""
-    block_number = 1  # Start numbering from 1
-    for obj in bpy.data.objects:
-        if obj.name.startswith(prefix):
-            new_name = f"{prefix}{active_object_name}_{str(block_number).zfill(2)}"
-            obj.name = new_name
-            block_number += 1
+    # Collect first: renaming re-sorts bpy.data.objects while it's being iterated
+    blocks = [obj for obj in bpy.data.objects if obj.name.startswith(prefix)]
+    base_name = f"{prefix}{active_object_name}_"
+    for block_number, obj in enumerate(blocks, start=1):  # Start numbering from 1
+        obj.name = f"{base_name}{block_number:02d}"
     print(f"Names refreshed for objects starting with {prefix}")
 
 def create_material_if_needed():
@@ -102,13 +133,17 @@ def create_material_if_needed():
     if material is None:
         material = bpy.data.materials.new(name=material_name)
         material.use_nodes = True
-        material.node_tree.nodes.clear()
-        bsdf = material.node_tree.nodes.new(type="ShaderNodeBsdfPrincipled")
+        nodes = material.node_tree.nodes
+        # use_nodes already creates a Principled BSDF linked to the output, reuse it
+        bsdf = next((node for node in nodes if node.type == 'BSDF_PRINCIPLED'), None)
+        if bsdf is None:
+            nodes.clear()
+            bsdf = nodes.new(type="ShaderNodeBsdfPrincipled")
+            material_output = nodes.new(type="ShaderNodeOutputMaterial")
+            material.node_tree.links.new(bsdf.outputs["BSDF"], material_output.inputs["Surface"])
         bsdf.inputs["Metallic"].default_value = 0
         bsdf.inputs["Roughness"].default_value = 1
         bsdf.inputs["Base Color"].default_value = (0.047, 1, 0, 1)  # Light green
-        material_output = material.node_tree.nodes.new(type="ShaderNodeOutputMaterial")
-        material.node_tree.links.new(bsdf.outputs["BSDF"], material_output.inputs["Surface"])
     return material
 
 def apply_material(obj, material):
@@ -120,41 +155,62 @@ def apply_material(obj, material):
 
 def apply_scale_offset_rotation(block, offset, rotation):
     """Apply offset, and rotation to the created block."""
-    block.location = (block.location[0] + offset[0], block.location[1] + offset[1], block.location[2] + offset[2])
-    block.rotation_euler = rotation
-    bpy.ops.object.transform_apply(location=True, rotation=True)
+    # Bake location + offset and rotation into the vertices, as transform_apply(location=True, rotation=True) would
+    location = block.location + Vector(offset)
+    matrix = np.array(Matrix.Translation(location) @ Euler(rotation).to_matrix().to_4x4())
+
+    vertices = block.data.vertices
+    n = len(vertices)
+    buf = np.empty(n * 3, dtype=np.float32)
+    vertices.foreach_get("co", buf)
+    coords = buf.reshape(n, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+    vertices.foreach_set("co", coords.astype(np.float32).ravel())
+    block.data.update()
+
+    block.location = (0, 0, 0)
+    block.rotation_euler = (0, 0, 0)
 
 def move_origin_to_geometry_center(block):
     """Move the origin of the block to the geometric center."""
-    # Активируем и выбираем нужный объект
-    bpy.context.view_layer.objects.active = block
-    block.select_set(True)
+    vertices = block.data.vertices
+    n = len(vertices)
+    if n == 0:
+        return
+    buf = np.empty(n * 3, dtype=np.float32)
+    vertices.foreach_get("co", buf)
+    coords = buf.reshape(n, 3)
 
-    # Переключаемся в Object Mode, если требуется
-    if bpy.context.mode != 'OBJECT':
-        bpy.ops.object.mode_set(mode='OBJECT')
+    # Центр bounding box, как у origin_set(type='ORIGIN_GEOMETRY', center='BOUNDS')
+    center = (coords.min(axis=0) + coords.max(axis=0)) * 0.5
+    coords -= center
+    vertices.foreach_set("co", buf)
+    block.data.update()
 
-    # Перемещаем origin в центр геометрии
-    bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY', center='BOUNDS')
+    # Сдвигаем origin в этот центр (поворот уже сброшен, масштаб равен 1)
+    block.location = block.location + Vector(center)
 
 def create_convex_hull(selected_verts):
-    """Create a convex hull around the selected vertices, removing isolated vertices."""
+    """Create a convex hull around the selected vertices, removing the vertices left inside it."""
+    # Load the selected verts into a mesh in bulk
+    flat = np.asarray(selected_verts, dtype=np.float32).ravel()
+    mesh = bpy.data.meshes.new("Convex_Hull")
+    mesh.vertices.add(len(flat) // 3)
+    mesh.vertices.foreach_set("co", flat)
+
     bm = bmesh.new()
-    
-    # Add vertices from the selected verts
-    for v in selected_verts:
-        bm.verts.new(v)
-    
-    bm.verts.ensure_lookup_table()
+    bm.from_mesh(mesh)
     
     # Create convex hull
-    bmesh.ops.convex_hull(bm, input=bm.verts)
+    result = bmesh.ops.convex_hull(bm, input=bm.verts)
     
-    # Remove isolated vertices (those not part of any edge)
-    bmesh.ops.delete(bm, geom=[v for v in bm.verts if not v.link_edges], context='VERTS')
+    if result["geom"]:
+        # Remove vertices left inside the hull, as reported by the operator
+        bmesh.ops.delete(bm, geom=result["geom_interior"], context='VERTS')
+    else:
+        # The operator cancelled without output, remove the isolated input vertices
+        bmesh.ops.delete(bm, geom=[v for v in bm.verts if not v.link_edges], context='VERTS')
     
-    # Create the mesh for the convex hull
-    mesh = bpy.data.meshes.new("Convex_Hull")
+    # Write the convex hull back to the mesh
     bm.to_mesh(mesh)
     bm.free()
     
@@ -163,12 +219,18 @@ def create_convex_hull(selected_verts):
     return obj
 
 
-def compute_pca_orientation(vertices):
-    """Compute the PCA to find the orientation of the selected vertices."""
-    coords = np.array(vertices)
-    coords_centered = coords - np.mean(coords, axis=0)
-    cov_matrix = np.cov(coords_centered.T)
-    eigenvalues, eigenvectors = np.linalg.eigh(cov_matrix)
+def compute_pca_orientation(coords):
+    """Compute the PCA to find the orientation of the given (N, 3) coordinate array."""
+    centered = np.empty(coords.shape, dtype=np.float64)
+    np.subtract(coords, coords.mean(axis=0, keepdims=True), out=centered)
+    # Scatter matrix; the covariance normalization doesn't change the eigenvectors
+    scatter_matrix = centered.T @ centered
+    eigenvalues, eigenvectors = np.linalg.eigh(scatter_matrix)
+    # Principal axis first, so the long side of the block maps to X
+    eigenvectors = eigenvectors[:, ::-1].copy()
+    # Right-handed frame, otherwise the orientation would mirror the block
+    if np.linalg.det(eigenvectors) < 0:
+        eigenvectors[:, 2] *= -1
     return eigenvectors
 
 def create_collision_block(context, method, use_selected_mesh_name, prefix, custom_name, auto_focus, offset, rotation):
@@ -179,31 +241,39 @@ def create_collision_block(context, method, use_selected_mesh_name, prefix, cust
         print("Please select a Mesh object")
         return
     
-    selected_verts = get_selected_vertices(obj)
-    if not selected_verts:
+    coords = get_selected_vertices(obj, current_mode)
+    if len(coords) == 0:
         print("No vertices selected!")
         return
+    if method == 'convex' and len(coords) < 3:
+        print("Select at least 3 vertices to create a convex hull!")
+        return
     
-    coords = np.array([[v.x, v.y, v.z] for v in selected_verts])
-    min_x, min_y, min_z = np.min(coords, axis=0)
-    max_x, max_y, max_z = np.max(coords, axis=0)
-    
-    block_number = len([obj for obj in bpy.data.objects if obj.name.startswith(custom_name if use_selected_mesh_name == 'false' else prefix)]) + 1
+    block_number = get_next_block_number(custom_name if use_selected_mesh_name == 'false' else prefix)
     block_name = generate_block_name(obj.name, use_selected_mesh_name, prefix, custom_name, block_number)
-    
-    previous_selection = [obj for obj in bpy.context.selected_objects] if not auto_focus else []
-    active_obj = obj
 
-    if method == 'convex':
-        if bpy.context.mode != 'OBJECT':
-            bpy.ops.object.mode_set(mode='OBJECT')
-
-        # Compute PCA orientation for the selected vertices
-        orientation = compute_pca_orientation(selected_verts)
-        matrix_orientation = Matrix(orientation).to_4x4()
+    if current_mode != 'OBJECT':
+        bpy.ops.object.mode_set(mode='OBJECT')
 
+    if method == 'convex':
         # Create the convex hull
-        new_block = create_convex_hull(selected_verts)
+        new_block = create_convex_hull(coords)
+        if len(new_block.data.polygons) == 0:
+            # Coincident or collinear vertices don't span a volume
+            hull_mesh = new_block.data
+            bpy.data.objects.remove(new_block)
+            bpy.data.meshes.remove(hull_mesh)
+            print("Selected vertices don't form a convex hull!")
+            if current_mode == 'EDIT_MESH':
+                bpy.ops.object.mode_set(mode='EDIT')
+            return
+
+        # Compute PCA orientation on the hull vertices, a much smaller set than the selection
+        hull_vertices = new_block.data.vertices
+        hull_coords = np.empty(len(hull_vertices) * 3, dtype=np.float32)
+        hull_vertices.foreach_get("co", hull_coords)
+        orientation = compute_pca_orientation(hull_coords.reshape(-1, 3))
+        matrix_orientation = Matrix(tuple(map(tuple, orientation))).to_4x4()
 
         # Apply orientation
         new_block.matrix_world = matrix_orientation
@@ -212,24 +282,19 @@ def create_collision_block(context, method, use_selected_mesh_name, prefix, cust
         new_block.name = block_name
 
     elif method == 'box':
-        center = ((min_x + max_x) / 2, (min_y + max_y) / 2, (min_z + max_z) / 2)
-        bpy.ops.object.mode_set(mode='OBJECT')
-        bpy.ops.mesh.primitive_cube_add(size=1, location=center)
-        new_block = context.object
-        mesh = new_block.data
-        
-        bm = bmesh.new()
-        bm.from_mesh(mesh)
-        for v in bm.verts:
-            global_co = new_block.matrix_world @ v.co
-            global_co.x = min_x if global_co.x < center[0] else max_x
-            global_co.y = min_y if global_co.y < center[1] else max_y
-            global_co.z = min_z if global_co.z < center[2] else max_z
-            v.co = new_block.matrix_world.inverted() @ global_co
-        bm.to_mesh(mesh)
-        bm.free()
+        min_x, min_y, min_z = coords.min(axis=0)
+        max_x, max_y, max_z = coords.max(axis=0)
+        center = np.array(((min_x + max_x) / 2, (min_y + max_y) / 2, (min_z + max_z) / 2))
 
-        new_block.name = block_name
+        # Build the box straight from the bounds of the selection, around its center
+        corners = np.array([[x, y, z] for x in (min_x, max_x) for y in (min_y, max_y) for z in (min_z, max_z)], dtype=np.float32) - center
+        mesh = bpy.data.meshes.new(block_name)
+        mesh.from_pydata(corners, [], BOX_FACES)
+        mesh.update()
+
+        new_block = bpy.data.objects.new(block_name, mesh)
+        new_block.location = center
+        context.collection.objects.link(new_block)
 
     material = create_material_if_needed()
     apply_material(new_block, material)
@@ -237,17 +302,12 @@ def create_collision_block(context, method, use_selected_mesh_name, prefix, cust
     # Move origin to the geometric center
     move_origin_to_geometry_center(new_block)
 
-    # If auto_focus is True, select the new block and deselect the original mesh
+    # If auto_focus is True, select the new block and deselect the original mesh.
+    # Otherwise there is nothing to restore: the block is created without touching the selection.
     if auto_focus:
         bpy.ops.object.select_all(action='DESELECT')
         new_block.select_set(True)
         bpy.context.view_layer.objects.active = new_block
-    else:
-        if not auto_focus:
-            bpy.ops.object.select_all(action='DESELECT')
-            for obj in previous_selection:
-                obj.select_set(True)
-            context.view_layer.objects.active = active_obj
 
     if current_mode == 'EDIT_MESH':
         bpy.ops.object.mode_set(mode='EDIT')